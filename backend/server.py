@@ -1,4 +1,4 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, BackgroundTasks
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
@@ -7,9 +7,12 @@ import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import Any, Awaitable, Callable, Dict, List, Optional
 import uuid
-from datetime import datetime
+import asyncio
+from datetime import datetime, timedelta
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 import bcrypt
 from enum import Enum
 
@@ -30,6 +33,15 @@ api_router = APIRouter(prefix="/api")
 # Security
 security = HTTPBearer()
 
+# Background job queue settings
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', '1.0'))
+JOB_VISIBILITY_TIMEOUT = int(os.environ.get('JOB_VISIBILITY_TIMEOUT', '60'))
+JOB_LOCK_MARGIN = int(os.environ.get('JOB_LOCK_MARGIN', '5'))
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', '5'))
+JOB_BACKOFF_BASE = int(os.environ.get('JOB_BACKOFF_BASE', '5'))
+JOB_RETENTION_SECONDS = int(os.environ.get('JOB_RETENTION_SECONDS', str(7 * 24 * 3600)))
+
 # Enums
 class OrderStatus(str, Enum):
     PENDING = "pending"
@@ -142,6 +154,34 @@ class DeliveryAddressCreate(BaseModel):
 class AddressCheckRequest(BaseModel):
     address: str
 
+class JobStatus(str, Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+class Job(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    type: str
+    payload: Dict[str, Any] = Field(default_factory=dict)
+    status: JobStatus = JobStatus.PENDING
+    attempts: int = 0
+    max_attempts: int = JOB_MAX_ATTEMPTS
+    run_at: datetime = Field(default_factory=datetime.utcnow)
+    locked_until: Optional[datetime] = None
+    claim_token: Optional[str] = None
+    last_error: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    finished_at: Optional[datetime] = None
+
+class OrderStats(BaseModel):
+    date: str
+    order_count: int
+    revenue: float
+    items_sold: int
+    computed_at: datetime
+
 # Hash password utility
 def hash_password(password: str) -> str:
     return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
@@ -170,6 +210,173 @@ async def init_default_admin():
         await db.admins.insert_one(default_admin.dict())
         print("Default admin created: username=admin, password=admin123")
 
+# Background job queue
+# Jobs live in the "jobs" collection. Workers claim one job at a time with an
+# atomic find_one_and_update; a claimed job is hidden until locked_until passes,
+# so a job whose worker died is picked up again after the visibility timeout.
+# Each claim writes a fresh claim_token and only the holder of the current
+# token may record the outcome, so a worker that lost its claim cannot
+# overwrite the result of the worker that took the job over.
+JobHandler = Callable[[Dict[str, Any]], Awaitable[None]]
+job_handlers: Dict[str, JobHandler] = {}
+job_workers: List[asyncio.Task] = []
+
+def job_handler(job_type: str):
+    def register(func: JobHandler) -> JobHandler:
+        job_handlers[job_type] = func
+        return func
+    return register
+
+async def enqueue_job(job_type: str, payload: Dict[str, Any]) -> Job:
+    job = Job(type=job_type, payload=payload)
+    await db.jobs.insert_one(job.dict())
+    return job
+
+async def claim_job() -> Optional[Job]:
+    now = datetime.utcnow()
+    job = await db.jobs.find_one_and_update(
+        {
+            "$or": [
+                {"status": JobStatus.PENDING.value, "run_at": {"$lte": now}},
+                {"status": JobStatus.RUNNING.value, "locked_until": {"$lte": now}}
+            ]
+        },
+        {
+            "$set": {
+                "status": JobStatus.RUNNING.value,
+                "claim_token": str(uuid.uuid4()),
+                "locked_until": now + timedelta(seconds=JOB_VISIBILITY_TIMEOUT),
+                "updated_at": now
+            },
+            "$inc": {"attempts": 1}
+        },
+        sort=[("run_at", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+    return Job(**job) if job else None
+
+async def finish_job(job: Job, update: Dict[str, Any]) -> bool:
+    now = datetime.utcnow()
+    update.update({"locked_until": None, "claim_token": None, "updated_at": now})
+    if update["status"] in (JobStatus.DONE.value, JobStatus.FAILED.value):
+        update["finished_at"] = now
+    result = await db.jobs.update_one(
+        {"id": job.id, "claim_token": job.claim_token, "status": JobStatus.RUNNING.value},
+        {"$set": update}
+    )
+    if result.modified_count == 0:
+        logger.warning(f"Job {job.id} ({job.type}) was reclaimed by another worker, discarding result")
+        return False
+    return True
+
+async def run_job(job: Job):
+    if job.attempts > job.max_attempts:
+        # Reclaimed after its lock expired on the last allowed attempt, which
+        # means the worker running it hung or died every time
+        logger.error(f"Job {job.id} ({job.type}) exceeded {job.max_attempts} attempts")
+        await finish_job(job, {"status": JobStatus.FAILED.value, "last_error": "Visibility timeout exceeded on final attempt"})
+        return
+
+    handler = job_handlers.get(job.type)
+    try:
+        if not handler:
+            raise RuntimeError(f"No handler registered for job type '{job.type}'")
+        # The lock was taken at claim time, so budget the handler against what
+        # is left of it (minus a margin) rather than a fresh full timeout
+        remaining = (job.locked_until - datetime.utcnow()).total_seconds() - JOB_LOCK_MARGIN
+        if remaining <= 0:
+            raise asyncio.TimeoutError()
+        await asyncio.wait_for(handler(job.payload), remaining)
+    except Exception as e:
+        error = str(e) or type(e).__name__
+        if job.attempts >= job.max_attempts:
+            update = {"status": JobStatus.FAILED.value}
+            logger.error(f"Job {job.id} ({job.type}) failed permanently: {error}")
+        else:
+            # Exponential backoff: base, 2*base, 4*base, ...
+            backoff = JOB_BACKOFF_BASE * (2 ** (job.attempts - 1))
+            update = {"status": JobStatus.PENDING.value, "run_at": datetime.utcnow() + timedelta(seconds=backoff)}
+            logger.warning(f"Job {job.id} ({job.type}) attempt {job.attempts} failed, retrying in {backoff}s: {error}")
+        update["last_error"] = error
+        await finish_job(job, update)
+        return
+
+    await finish_job(job, {"status": JobStatus.DONE.value})
+
+async def job_worker(worker_id: int):
+    while True:
+        try:
+            job = await claim_job()
+            if not job:
+                await asyncio.sleep(JOB_POLL_INTERVAL)
+                continue
+            await run_job(job)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception(f"Job worker {worker_id} error: {e}")
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+
+async def start_job_workers():
+    await db.jobs.create_index([("status", 1), ("run_at", 1)])
+    await db.jobs.create_index([("status", 1), ("locked_until", 1)])
+    await db.jobs.create_index("id", unique=True)
+    # finished_at is only set on done/failed jobs, so pending work never expires
+    await db.jobs.create_index("finished_at", expireAfterSeconds=JOB_RETENTION_SECONDS)
+    for worker_id in range(JOB_WORKERS):
+        job_workers.append(asyncio.create_task(job_worker(worker_id)))
+
+async def stop_job_workers():
+    for task in job_workers:
+        task.cancel()
+    await asyncio.gather(*job_workers, return_exceptions=True)
+    job_workers.clear()
+
+# Order analytics
+# order_stats holds one document per day. The rollup job recomputes the whole
+# day from the orders collection, so re-running it is always safe and a failed
+# run simply retries.
+async def init_order_analytics():
+    await db.order_stats.create_index("date", unique=True)
+    await db.orders.create_index("created_at")
+
+@job_handler("order.analytics")
+async def update_order_analytics(payload: Dict[str, Any]):
+    order = await db.orders.find_one({"id": payload["order_id"]})
+    if not order:
+        return
+    computed_at = datetime.utcnow()
+    day_start = order["created_at"].replace(hour=0, minute=0, second=0, microsecond=0)
+    totals = await db.orders.aggregate([
+        {"$match": {
+            "created_at": {"$gte": day_start, "$lt": day_start + timedelta(days=1)},
+            "status": {"$ne": OrderStatus.CANCELLED.value}
+        }},
+        {"$group": {
+            "_id": None,
+            "order_count": {"$sum": 1},
+            "revenue": {"$sum": "$total_amount"},
+            "items_sold": {"$sum": {"$sum": "$items.quantity"}}
+        }}
+    ]).to_list(1)
+    stats = totals[0] if totals else {"order_count": 0, "revenue": 0.0, "items_sold": 0}
+    try:
+        # Only overwrite a snapshot taken earlier than ours, so a slow job
+        # cannot replace newer totals with stale ones
+        await db.order_stats.update_one(
+            {"date": day_start.strftime("%Y-%m-%d"), "computed_at": {"$lt": computed_at}},
+            {"$set": {
+                "order_count": stats["order_count"],
+                "revenue": stats["revenue"],
+                "items_sold": stats["items_sold"],
+                "computed_at": computed_at
+            }},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        # A newer snapshot for this day already exists
+        pass
+
 # Routes
 @api_router.get("/")
 async def root():
@@ -257,7 +464,7 @@ async def delete_product(product_id: str, admin: Admin = Depends(get_current_adm
 
 # Order Routes
 @api_router.post("/orders", response_model=Order)
-async def create_order(order_data: OrderCreate):
+async def create_order(order_data: OrderCreate, background_tasks: BackgroundTasks):
     # Calculate delivery fee based on address
     delivery_fee = 0.0
     delivery_address = await db.delivery_addresses.find_one({
@@ -280,6 +487,8 @@ async def create_order(order_data: OrderCreate):
     )
     
     await db.orders.insert_one(order.dict())
+    # Enqueued after the response is sent, so checkout only waits on the order insert
+    background_tasks.add_task(enqueue_job, "order.analytics", {"order_id": order.id})
     return order
 
 @api_router.get("/orders", response_model=List[Order])
@@ -295,7 +504,7 @@ async def get_order(order_id: str):
     return Order(**order)
 
 @api_router.put("/orders/{order_id}", response_model=Order)
-async def update_order(order_id: str, order_data: OrderUpdate, admin: Admin = Depends(get_current_admin)):
+async def update_order(order_id: str, order_data: OrderUpdate, background_tasks: BackgroundTasks, admin: Admin = Depends(get_current_admin)):
     existing_order = await db.orders.find_one({"id": order_id})
     if not existing_order:
         raise HTTPException(status_code=404, detail="Order not found")
@@ -304,8 +513,17 @@ async def update_order(order_id: str, order_data: OrderUpdate, admin: Admin = De
     await db.orders.update_one({"id": order_id}, {"$set": update_data})
     
     updated_order = await db.orders.find_one({"id": order_id})
+    if order_data.status is not None:
+        # Cancelling an order changes that day's totals
+        background_tasks.add_task(enqueue_job, "order.analytics", {"order_id": order_id})
     return Order(**updated_order)
 
+# Order Stats Routes
+@api_router.get("/order-stats", response_model=List[OrderStats])
+async def get_order_stats(admin: Admin = Depends(get_current_admin)):
+    stats = await db.order_stats.find().sort("date", -1).to_list(1000)
+    return [OrderStats(**day) for day in stats]
+
 # Delivery Address Routes
 @api_router.post("/delivery-addresses", response_model=DeliveryAddress)
 async def create_delivery_address(address_data: DeliveryAddressCreate, admin: Admin = Depends(get_current_admin)):
@@ -394,7 +612,10 @@ logger = logging.getLogger(__name__)
 @app.on_event("startup")
 async def startup_event():
     await init_default_admin()
+    await init_order_analytics()
+    await start_job_workers()
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await stop_job_workers()
     client.close()
@@ -0,0 +1,18 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import server  # noqa: E402
+
+
+@pytest.fixture
+def mock_db(monkeypatch):
+    db = AsyncMongoMockClient()["test_database"]
+    monkeypatch.setattr(server, "db", db)
+    asyncio.run(server.init_order_analytics())
+    return db
@@ -0,0 +1,164 @@
+# These tests run against mongomock. They cover the queue's filters, state
+# transitions and handlers; the atomicity of claiming comes from MongoDB's
+# find_one_and_update and is not exercised here.
+import asyncio
+from datetime import datetime, timedelta
+
+import server
+from server import JobStatus, claim_job, enqueue_job, run_job
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def job_doc(db):
+    return run(db.jobs.find_one({}))
+
+
+def set_job(db, **fields):
+    run(db.jobs.update_one({}, {"$set": fields}))
+
+
+def test_claimed_job_is_hidden_until_lock_expires(mock_db):
+    run(enqueue_job("test.job", {}))
+
+    first = run(claim_job())
+    assert first.status == JobStatus.RUNNING
+    assert first.attempts == 1
+    assert run(claim_job()) is None
+
+    set_job(mock_db, locked_until=datetime.utcnow() - timedelta(seconds=1))
+    second = run(claim_job())
+    assert second.id == first.id
+    assert second.attempts == 2
+    assert second.claim_token != first.claim_token
+
+
+def test_stale_worker_cannot_overwrite_result(mock_db, monkeypatch):
+    monkeypatch.setitem(server.job_handlers, "test.job", lambda payload: asyncio.sleep(0))
+    run(enqueue_job("test.job", {}))
+    first = run(claim_job())
+    set_job(mock_db, locked_until=datetime.utcnow() - timedelta(seconds=1))
+    second = run(claim_job())
+
+    run(run_job(second))
+    assert job_doc(mock_db)["status"] == JobStatus.DONE.value
+
+    # The first worker's lock expired, so its late result is discarded
+    first.locked_until = datetime.utcnow() + timedelta(seconds=60)
+    run(run_job(first))
+    assert job_doc(mock_db)["status"] == JobStatus.DONE.value
+
+
+def test_failed_job_is_retried_with_backoff(mock_db, monkeypatch):
+    async def failing(payload):
+        raise RuntimeError("boom")
+
+    monkeypatch.setitem(server.job_handlers, "test.job", failing)
+    run(enqueue_job("test.job", {}))
+
+    before = datetime.utcnow()
+    run(run_job(run(claim_job())))
+    doc = job_doc(mock_db)
+    assert doc["status"] == JobStatus.PENDING.value
+    assert doc["last_error"] == "boom"
+    assert doc["run_at"] >= before + timedelta(seconds=server.JOB_BACKOFF_BASE)
+
+    set_job(mock_db, run_at=datetime.utcnow())
+    before = datetime.utcnow()
+    run(run_job(run(claim_job())))
+    assert job_doc(mock_db)["run_at"] >= before + timedelta(seconds=2 * server.JOB_BACKOFF_BASE)
+
+
+def test_job_fails_permanently_after_max_attempts(mock_db, monkeypatch):
+    async def failing(payload):
+        raise RuntimeError("boom")
+
+    monkeypatch.setitem(server.job_handlers, "test.job", failing)
+    job = run(enqueue_job("test.job", {}))
+    set_job(mock_db, attempts=job.max_attempts - 1)
+
+    run(run_job(run(claim_job())))
+    doc = job_doc(mock_db)
+    assert doc["status"] == JobStatus.FAILED.value
+    assert doc["finished_at"] is not None
+    assert run(claim_job()) is None
+
+
+def test_hung_job_fails_once_attempts_are_exhausted(mock_db):
+    job = run(enqueue_job("test.job", {}))
+    set_job(
+        mock_db,
+        status=JobStatus.RUNNING.value,
+        attempts=job.max_attempts,
+        locked_until=datetime.utcnow() - timedelta(seconds=1),
+    )
+
+    claimed = run(claim_job())
+    assert claimed.attempts == job.max_attempts + 1
+    run(run_job(claimed))
+    assert job_doc(mock_db)["status"] == JobStatus.FAILED.value
+
+
+def test_handler_is_stopped_before_its_lock_expires(mock_db, monkeypatch):
+    monkeypatch.setattr(server, "JOB_VISIBILITY_TIMEOUT", 1)
+    monkeypatch.setattr(server, "JOB_LOCK_MARGIN", 0.9)
+    monkeypatch.setitem(server.job_handlers, "test.job", lambda payload: asyncio.sleep(5))
+    run(enqueue_job("test.job", {}))
+
+    job = run(claim_job())
+    started = datetime.utcnow()
+    run(run_job(job))
+    assert datetime.utcnow() < job.locked_until
+    assert datetime.utcnow() - started < timedelta(seconds=0.5)
+    assert job_doc(mock_db)["status"] == JobStatus.PENDING.value
+
+
+def insert_order(db, order_id, total, quantity, status="pending", created_at=datetime(2026, 1, 2, 10, 0)):
+    run(db.orders.insert_one({
+        "id": order_id,
+        "created_at": created_at,
+        "status": status,
+        "total_amount": total,
+        "items": [{"product_id": "p1", "quantity": quantity}],
+    }))
+
+
+def day_stats(db, day="2026-01-02"):
+    return run(db.order_stats.find_one({"date": day}))
+
+
+def test_order_analytics_rerun_is_idempotent(mock_db):
+    insert_order(mock_db, "o1", 10.0, 2)
+    insert_order(mock_db, "o2", 5.0, 1)
+    insert_order(mock_db, "o3", 7.0, 4, status="cancelled")
+    insert_order(mock_db, "o4", 3.0, 1, created_at=datetime(2026, 1, 3, 9, 0))
+
+    for order_id in ("o1", "o1", "o2"):
+        run(server.update_order_analytics({"order_id": order_id}))
+
+    stats = day_stats(mock_db)
+    assert stats["order_count"] == 2
+    assert stats["revenue"] == 15.0
+    assert stats["items_sold"] == 3
+    assert day_stats(mock_db, "2026-01-03") is None
+
+
+def test_order_analytics_keeps_newer_snapshot(mock_db):
+    insert_order(mock_db, "o1", 10.0, 2)
+    newer = datetime.utcnow() + timedelta(minutes=1)
+    run(mock_db.order_stats.insert_one({
+        "date": "2026-01-02", "order_count": 5, "revenue": 50.0, "items_sold": 9, "computed_at": newer,
+    }))
+
+    run(server.update_order_analytics({"order_id": "o1"}))
+    assert day_stats(mock_db)["order_count"] == 5
+
+
+def test_order_analytics_for_missing_order_is_a_no_op(mock_db):
+    run(enqueue_job("order.analytics", {"order_id": "missing"}))
+
+    run(run_job(run(claim_job())))
+    assert job_doc(mock_db)["status"] == JobStatus.DONE.value
+    assert run(mock_db.order_stats.count_documents({})) == 0